@@ -1,11 +1,37 @@
-import re
 import argparse
+import asyncio
 import os
+import sys
 from datetime import datetime
 from pathlib import Path
-import subprocess
+from typing import List, Tuple
+
+import orjson
+from dotenv import load_dotenv
+from openai import OpenAI
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from automation import pipeline  # noqa: E402
+from embeddings.update_faiss import add_chunks  # noqa: E402
+from rag_pipeline.ask import (  # noqa: E402
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_INDEX,
+    DEFAULT_META,
+    answer_from_search,
+    embed_queries,
+    latest_filing_rows,
+    load_index,
+    score_rows,
+    search,
+)
+from scripts.scrape_sec import DEFAULT_USER_AGENT, normalize_tickers  # noqa: E402
 
 TICKERS_DEFAULT = "AAPL,MSFT,NVDA,TSLA,AMZN"
+CLEAN_DIR = Path("data/clean/sec")
+CHUNKS_PATH = Path("data/chunks/sec_chunks.jsonl")  # default --chunks of build_faiss.py / update_faiss.py
 
 DAILY_QUESTIONS = [
     ("Market-moving disclosures (AMZN)", 'What did Amazon disclose in its most recent 8-K?', "AMZN", "8-K"),
@@ -16,70 +42,104 @@ DAILY_QUESTIONS = [
 ]
 
 
-def run(cmd: list[str]) -> str:
-    res = subprocess.run(cmd, capture_output=True, text=True)
-    if res.returncode != 0:
-        raise RuntimeError(f"Command failed: {' '.join(cmd)}\n{res.stderr}")
-    return res.stdout.strip()
+def format_answer(ans: str, sources: List[str]) -> str:
+    # Keep only the Answer and the first source URL for cleaner briefs
+    if sources:
+        return ans.strip() + "\nSource: " + sources[0]
+    return ans.strip()
+
+
+async def ask_daily_questions(index, meta_path: Path, client: OpenAI) -> List[Tuple[str, List[str]]]:
+    # One embeddings request for all questions; each question's latest filing comes
+    # from the metadata DB, with one FAISS batch search as fallback if it's missing.
+    # The per-question chat calls then overlap on a shared index + client
+    qvecs = embed_queries(client, [q for _, q, _, _ in DAILY_QUESTIONS], DEFAULT_EMBED_MODEL)
+    latest = [
+        latest_filing_rows(meta_path, ticker, doc_type, index.ntotal) for _, _, ticker, doc_type in DAILY_QUESTIONS
+    ]
+    if any(rows is None for rows in latest):
+        scores, idxs = search(index, qvecs, 80)
+    hits = [
+        (score_rows(index, qvecs[row], rows), rows) if rows is not None else (scores[row], idxs[row])
+        for row, rows in enumerate(latest)
+    ]
+    return await asyncio.gather(*[
+        asyncio.to_thread(
+            answer_from_search, q, row_scores, row_idxs,
+            meta_path=meta_path, client=client,
+            ticker=ticker, doc_type=doc_type, most_recent=True, max_chunks=10,
+        )
+        for (row_scores, row_idxs), (_, q, ticker, doc_type) in zip(hits, DAILY_QUESTIONS)
+    ])
+
+
+def append_chunks(chunks: List[dict], chunks_path: Path) -> int:
+    """Append chunks not already in chunks_path (by chunk_id), so a full rebuild from it keeps them."""
+    existing = set()
+    if chunks_path.exists():
+        with open(chunks_path, "rb") as f:
+            existing = {orjson.loads(line).get("chunk_id") for line in f}
+    new = [c for c in chunks if c.get("chunk_id") not in existing]
+    chunks_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(chunks_path, "ab") as f:
+        for c in new:
+            f.write(orjson.dumps(c) + b"\n")
+    return len(new)
+
+
+def write_report(tickers: str, report_path: Path) -> Path:
+    """Answer DAILY_QUESTIONS against the current index and write the brief to report_path."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY missing in .env")
+    client = OpenAI(api_key=api_key)
+    index = load_index(DEFAULT_INDEX)
+    results = asyncio.run(ask_daily_questions(index, Path(DEFAULT_META), client))
 
+    today = datetime.now().strftime("%Y-%m-%d")
+    lines = []
+    lines.append(f"Daily Financial Brief — {today}\n")
+    lines.append(f"Tickers: {tickers}\n")
 
-def extract_answer_and_first_source(output: str) -> str:
-    # Keep only the Answer and the first source URL for cleaner briefs
-    ans = ''
-    src = ''
-    m = re.search(r"=== Answer ===\n\n(.*?)(?:\n\n=== Sources|\Z)", output, re.S)
-    if m:
-        ans = m.group(1).strip()
-    m2 = re.search(r"=== Sources \(top hits\) ===\n- (.+)", output)
-    if m2:
-        src = m2.group(1).strip()
-    if not ans:
-        ans = output.strip()
-    if src:
-        return ans + "\nSource: " + src
-    return ans
+    for (title, _, _, _), (ans, sources) in zip(DAILY_QUESTIONS, results):
+        lines.append("=" * 80)
+        lines.append(title)
+        lines.append("-" * 80)
+        lines.append(format_answer(ans, sources))
+        lines.append("")
+
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text("\n".join(lines), encoding="utf-8")
+    return report_path
 
 
 def main():
+    load_dotenv()
     parser = argparse.ArgumentParser()
     parser.add_argument("--tickers", type=str, default=os.getenv("TICKERS", TICKERS_DEFAULT))
     parser.add_argument("--forms", type=str, default="8-K")
-    parser.add_argument("--limit", type=str, default="6")
+    parser.add_argument("--limit", type=int, default=6)
     args = parser.parse_args()
 
     today = datetime.now().strftime("%Y-%m-%d")
     report_path = Path("reports") / f"daily_{today}.txt"
     report_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # 1) Scrape + clean
-    run(["python", "scripts/scrape_sec.py", "--tickers", args.tickers, "--forms", args.forms, "--limit", args.limit])
-    run(["python", "preprocess/clean_docs.py"])
-
-    # 2) Chunk + update FAISS
-    run(["python", "embeddings/chunk_docs.py"])
-    run(["python", "embeddings/update_faiss.py"])
+    # 1) Scrape + clean + chunk in memory, 2) add new chunks to FAISS
+    CLEAN_DIR.mkdir(parents=True, exist_ok=True)
+    chunks = list(pipeline.run(
+        tickers=normalize_tickers(args.tickers.split(",")),
+        forms=[f.strip() for f in args.forms.split(",") if f.strip()],
+        limit=args.limit,
+        user_agent=os.getenv("SEC_USER_AGENT", DEFAULT_USER_AGENT),
+        clean_dir=CLEAN_DIR,
+    ))
+    # Keep the chunks file complete too: it is what build_faiss.py rebuilds from
+    append_chunks(chunks, CHUNKS_PATH)
+    add_chunks(chunks, Path(DEFAULT_INDEX), Path(DEFAULT_META))
 
     # 3) Ask standard questions and write report
-    lines = []
-    lines.append(f"Daily Financial Brief — {today}\n")
-    lines.append(f"Tickers: {args.tickers}\n")
-
-    for title, q, ticker, doc_type in DAILY_QUESTIONS:
-        lines.append("=" * 80)
-        lines.append(title)
-        lines.append("-" * 80)
-        out = run([
-            "python", "rag_pipeline/ask.py", q,
-            "--ticker", ticker,
-            "--doc-type", doc_type,
-            "--most-recent",
-            "--k", "80",
-            "--max-chunks", "10"
-        ])
-        lines.append(extract_answer_and_first_source(out))
-        lines.append("")
-
-    report_path.write_text("\n".join(lines), encoding="utf-8")
+    write_report(args.tickers, report_path)
     print(f"Wrote report to {report_path}")
 
 
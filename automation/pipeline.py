@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import orjson
+
+from embeddings.chunk_docs import chunk_doc
+from preprocess.clean_docs import clean_one
+from scripts.scrape_sec import DEFAULT_USER_AGENT, fetch_sec_filings, safe_filename
+
+
+def run(
+    tickers: List[str],
+    forms: List[str],
+    limit: int,
+    user_agent: str = DEFAULT_USER_AGENT,
+    sleep_s: float = 0.25,
+    chunk_size: int = 1200,
+    overlap: int = 150,
+    clean_dir: Optional[Path] = None,
+) -> Iterator[Dict]:
+    """Scrape -> clean -> chunk entirely in memory, yielding chunk dicts.
+
+    Same records as scripts/scrape_sec.py + preprocess/clean_docs.py + embeddings/chunk_docs.py,
+    minus the raw intermediate files; those scripts remain for debugging single stages.
+    If clean_dir is given, cleaned docs are saved there under the names clean_docs.py uses,
+    so a later chunk_docs.py run still sees these filings.
+    """
+    raw_items = fetch_sec_filings(tickers, forms, limit, user_agent, sleep_s)
+    if not raw_items:
+        return
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for cleaned in ex.map(clean_one, raw_items):
+            if cleaned:
+                if clean_dir:
+                    (clean_dir / (safe_filename(cleaned["id"]) + ".json")).write_bytes(orjson.dumps(cleaned))
+                yield from chunk_doc(cleaned, chunk_size, overlap)
@@ -1,32 +1,183 @@
 import argparse
-import json
+import asyncio
 import os
+import sqlite3
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
 import numpy as np
 import faiss
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from tqdm import tqdm
 
 
 def load_chunks(jsonl_path: Path) -> List[dict]:
     chunks = []
-    with open(jsonl_path, "r", encoding="utf-8") as f:
+    with open(jsonl_path, "rb") as f:
         for line in f:
-            chunks.append(json.loads(line))
+            chunks.append(orjson.loads(line))
     return chunks
 
 
-def embed_texts(client: OpenAI, texts: List[str], model: str, batch_size: int = 64) -> np.ndarray:
-    vectors = []
-    for i in tqdm(range(0, len(texts), batch_size), desc="Embedding"):
-        batch = texts[i : i + batch_size]
-        resp = client.embeddings.create(model=model, input=batch)
-        batch_vecs = [d.embedding for d in resp.data]
-        vectors.extend(batch_vecs)
-    return np.array(vectors, dtype="float32")
+async def embed_texts(
+    client: AsyncOpenAI, texts: List[str], model: str, batch_size: int = 64, concurrency: int = 8
+) -> np.ndarray:
+    # Batches are requested concurrently (bounded by a semaphore) and copied into a
+    # preallocated (N, D) array as they arrive
+    sem = asyncio.Semaphore(concurrency)
+    vectors = None
+    pbar = tqdm(total=-(-len(texts) // batch_size), desc="Embedding")
+
+    async def embed_batch(i: int) -> None:
+        nonlocal vectors
+        async with sem:
+            resp = await client.embeddings.create(model=model, input=texts[i : i + batch_size])
+        if vectors is None:
+            vectors = np.empty((len(texts), len(resp.data[0].embedding)), dtype="float32")
+        for j, d in enumerate(resp.data):
+            vectors[i + j] = d.embedding
+        pbar.update(1)
+
+    await asyncio.gather(*[embed_batch(i) for i in range(0, len(texts), batch_size)])
+    pbar.close()
+    if vectors is None:
+        return np.empty((0, 0), dtype="float32")
+    return vectors
+
+
+def default_nlist(n: int) -> int:
+    # ~4*sqrt(N) lists, but keep >= 39 training points per centroid as FAISS recommends
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+
+def make_index(kind: str, dim: int, nlist: int = 1) -> faiss.Index:
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        # Graph ANN: ~log(N) search; vectors are L2-normalized so inner product == cosine
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+        return index
+    if kind == "sq8":
+        # int8 codes: 4x fewer bytes per vector than FP32 for the bandwidth-bound scan
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivf":
+        # Inverted lists can be memory-mapped at query time (see rag_pipeline/ask.py)
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat", faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(16, nlist)
+        return index
+    if kind == "ivf-sq8":
+        # Both: IVF prunes which lists are scanned, int8 codes shrink each scanned vector 4x
+        index = faiss.index_factory(dim, f"IVF{nlist},SQ8", faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(16, nlist)
+        return index
+    raise ValueError(f"Unknown index type: {kind}")
+
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    # Readers open or memory-map the index and its sidecars (see rag_pipeline/ask.py),
+    # so never rewrite them in place: the caller writes the yielded sibling temp path,
+    # which is renamed over `path` on success. Existing readers keep the old inode.
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def write_index_atomic(index: faiss.Index, index_path: Path) -> None:
+    with atomic_path(index_path) as tmp:
+        faiss.write_index(index, str(tmp))
+
+
+def save_npy_atomic(path: Path, arr: np.ndarray) -> None:
+    with atomic_path(path) as tmp, open(tmp, "wb") as f:
+        np.save(f, arr)
+
+
+def savez_atomic(path: Path, arrays: dict) -> None:
+    with atomic_path(path) as tmp, open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def write_meta(chunks: List[dict], meta_path: Path) -> None:
+    # One chunk per line, plus a sidecar of byte offsets (N+1 entries) so readers
+    # can fetch individual rows without parsing the whole file
+    offsets = [0]
+    with atomic_path(meta_path) as tmp, open(tmp, "wb") as f:
+        for c in chunks:
+            line = orjson.dumps(c) + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    save_npy_atomic(meta_path.with_suffix(".offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+def meta_arrays(chunks: List[dict]) -> dict:
+    # Column-wise copies of the filter fields so ask.py can filter hits with NumPy masks
+    metas = [c.get("meta", {}) for c in chunks]
+    return {
+        "ticker": np.array([(m.get("ticker") or "").upper() for m in metas], dtype=str),
+        "doc_type": np.array([(m.get("doc_type") or "").upper() for m in metas], dtype=str),
+        "filing_date": np.array([m.get("filing_date") or None for m in metas], dtype="datetime64[D]"),
+        "url": np.array([m.get("url") or "" for m in metas], dtype=str),
+    }
+
+
+def insert_meta_rows(con: sqlite3.Connection, chunks: List[dict], first_row: int) -> None:
+    # Chunks become FAISS rows first_row, first_row+1, ...; each filing (keyed by URL)
+    # is inserted the first time one of its chunks shows up
+    for row, c in enumerate(chunks, start=first_row):
+        m = c.get("meta", {})
+        url = m.get("url") or ""
+        con.execute(
+            "INSERT OR IGNORE INTO filings (url, ticker, doc_type, filing_date) VALUES (?, ?, ?, ?)",
+            (url, (m.get("ticker") or "").upper(), (m.get("doc_type") or "").upper(), m.get("filing_date")),
+        )
+        con.execute(
+            "INSERT INTO chunks (row, chunk_id, filing_id) VALUES (?, ?, (SELECT id FROM filings WHERE url = ?))",
+            (row, c.get("chunk_id"), url),
+        )
+
+
+def write_meta_db(chunks: List[dict], db_path: Path) -> None:
+    # Filings and the FAISS rows of their chunks, so ask.py can jump straight to a
+    # ticker's latest filing without a similarity search
+    with atomic_path(db_path) as tmp:
+        _create_meta_db(chunks, tmp)
+
+
+def _create_meta_db(chunks: List[dict], db_path: Path) -> None:
+    con = sqlite3.connect(db_path)
+    try:
+        con.executescript(
+            """
+            CREATE TABLE filings (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE,
+                ticker TEXT,
+                doc_type TEXT,
+                filing_date TEXT
+            );
+            CREATE TABLE chunks (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT,
+                filing_id INTEGER REFERENCES filings(id)
+            );
+            CREATE INDEX idx_tdf ON filings(ticker, doc_type, filing_date DESC);
+            CREATE INDEX idx_chunks_filing ON chunks(filing_id);
+            """
+        )
+        insert_meta_rows(con, chunks, first_row=0)
+        con.commit()
+    finally:
+        con.close()
 
 
 def main():
@@ -35,13 +186,17 @@ def main():
     parser.add_argument("--chunks", type=str, default="data/chunks/sec_chunks.jsonl")
     parser.add_argument("--out-dir", type=str, default="data/index")
     parser.add_argument("--model", type=str, default="text-embedding-3-small")
+    parser.add_argument(
+        "--index-type", type=str, default="ivf-sq8", choices=["flat", "hnsw", "sq8", "ivf", "ivf-sq8"]
+    )
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default: derived from corpus size)")
     args = parser.parse_args()
 
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY missing. Add it to .env")
 
-    client = OpenAI(api_key=api_key)
+    client = AsyncOpenAI(api_key=api_key)
 
     chunks_path = Path(args.chunks)
     out_dir = Path(args.out_dir)
@@ -50,20 +205,24 @@ def main():
     chunks = load_chunks(chunks_path)
     texts = [c["text"] for c in chunks]
 
-    vectors = embed_texts(client, texts, model=args.model)
+    vectors = asyncio.run(embed_texts(client, texts, model=args.model))
 
     dim = vectors.shape[1]
-    index = faiss.IndexFlatIP(dim)
+    index = make_index(args.index_type, dim, nlist=args.nlist or default_nlist(len(vectors)))
     faiss.normalize_L2(vectors)
+    if not index.is_trained:
+        index.train(vectors)
     index.add(vectors)
 
-    faiss.write_index(index, str(out_dir / "sec.index"))
-
-    with open(out_dir / "sec_meta.json", "w", encoding="utf-8") as f:
-        json.dump(chunks, f, ensure_ascii=False)
+    # Metadata first, index last: a reader that picks up the new index must never
+    # find FAISS rows past the end of the metadata
+    write_meta(chunks, out_dir / "sec_meta.jsonl")
+    savez_atomic(out_dir / "sec_meta.npz", meta_arrays(chunks))
+    write_meta_db(chunks, out_dir / "sec_meta.sqlite")
+    write_index_atomic(index, out_dir / "sec.index")
 
     print(f"Saved FAISS index to {out_dir/'sec.index'}")
-    print(f"Saved metadata to {out_dir/'sec_meta.json'}")
+    print(f"Saved metadata to {out_dir/'sec_meta.jsonl'}")
 
 
 if __name__ == "__main__":
@@ -1,33 +1,49 @@
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
 
+import orjson
 from tqdm import tqdm
 
 
 def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[str]:
-    chunks = []
-    start = 0
-    n = len(text)
-    while start < n:
-        end = min(start + chunk_size, n)
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        if end == n:
-            break
-        start = max(0, end - overlap)
-    return chunks
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+    # A window starts every `step` chars until one reaches the end of the text
+    starts = range(0, max(len(text) - overlap, 1), step)
+    return [chunk for s in starts if (chunk := text[s : s + chunk_size].strip())]
 
 
-def main():
+def chunk_doc(doc: Dict, chunk_size: int = 1200, overlap: int = 150) -> Iterator[Dict]:
+    text = doc.get("text", "")
+    if not text:
+        return
+
+    chunks = chunk_text(text, chunk_size, overlap)
+    for idx, ch in enumerate(chunks):
+        yield {
+            "chunk_id": f"{doc.get('id')}::chunk_{idx}",
+            "text": ch,
+            "meta": {
+                "id": doc.get("id"),
+                "ticker": doc.get("ticker"),
+                "doc_type": doc.get("doc_type"),
+                "filing_date": doc.get("filing_date"),
+                "url": doc.get("url"),
+                "source": doc.get("source"),
+            },
+        }
+
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--in-dir", type=str, default="data/clean/sec")
     parser.add_argument("--out", type=str, default="data/chunks/sec_chunks.jsonl")
     parser.add_argument("--chunk-size", type=int, default=1200)
     parser.add_argument("--overlap", type=int, default=150)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     in_dir = Path(args.in_dir)
     out_path = Path(args.out)
@@ -39,28 +55,12 @@ def main():
         return
 
     total = 0
-    with open(out_path, "w", encoding="utf-8") as out_f:
-        for fp in tqdm(files, desc="Chunking"):
-            doc = json.load(open(fp, "r", encoding="utf-8"))
-            text = doc.get("text", "")
-            if not text:
-                continue
-
-            chunks = chunk_text(text, args.chunk_size, args.overlap)
-            for idx, ch in enumerate(chunks):
-                item = {
-                    "chunk_id": f"{doc.get('id')}::chunk_{idx}",
-                    "text": ch,
-                    "meta": {
-                        "id": doc.get("id"),
-                        "ticker": doc.get("ticker"),
-                        "doc_type": doc.get("doc_type"),
-                        "filing_date": doc.get("filing_date"),
-                        "url": doc.get("url"),
-                        "source": doc.get("source"),
-                    },
-                }
-                out_f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    # Reads overlap on threads (file I/O releases the GIL); chunking stays in order on this thread
+    with open(out_path, "wb") as out_f, ThreadPoolExecutor(max_workers=16) as ex:
+        docs = ex.map(lambda fp: orjson.loads(fp.read_bytes()), files)
+        for doc in tqdm(docs, total=len(files), desc="Chunking"):
+            for item in chunk_doc(doc, args.chunk_size, args.overlap):
+                out_f.write(orjson.dumps(item) + b"\n")
                 total += 1
 
     print(f"Wrote {total} chunks to {out_path}")
@@ -1,80 +1,136 @@
 import argparse
-import json
+import asyncio
 import os
+import sqlite3
+import sys
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import Iterable, List, Dict, Optional, Set
 
 import numpy as np
 import faiss
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
-from tqdm import tqdm
+from openai import AsyncOpenAI
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from embeddings.build_faiss import (  # noqa: E402
+    embed_texts,
+    insert_meta_rows,
+    meta_arrays,
+    save_npy_atomic,
+    savez_atomic,
+    write_index_atomic,
+)
 
 
 def load_jsonl(path: Path) -> List[dict]:
     items = []
-    with open(path, "r", encoding="utf-8") as f:
+    with open(path, "rb") as f:
         for line in f:
-            items.append(json.loads(line))
+            items.append(orjson.loads(line))
     return items
 
 
-def embed_texts(client: OpenAI, texts: List[str], model: str, batch_size: int = 64) -> np.ndarray:
-    vectors = []
-    for i in tqdm(range(0, len(texts), batch_size), desc="Embedding"):
-        batch = texts[i : i + batch_size]
-        resp = client.embeddings.create(model=model, input=batch)
-        vectors.extend([d.embedding for d in resp.data])
-    arr = np.array(vectors, dtype="float32")
-    faiss.normalize_L2(arr)
-    return arr
-
-
-def main():
-    load_dotenv()
-    p = argparse.ArgumentParser()
-    p.add_argument("--chunks", type=str, default="data/chunks/sec_chunks.jsonl")
-    p.add_argument("--index", type=str, default="data/index/sec.index")
-    p.add_argument("--meta", type=str, default="data/index/sec_meta.json")
-    p.add_argument("--embed-model", type=str, default="text-embedding-3-small")
-    args = p.parse_args()
-
+def load_meta_ids(meta_path: Path) -> Set[str]:
+    with open(meta_path, "rb") as f:
+        return {orjson.loads(line).get("chunk_id") for line in f}
+
+
+def append_meta(items: List[dict], meta_path: Path) -> None:
+    # The JSONL only grows (readers locate rows via the offsets), so it is appended in
+    # place; the offsets sidecar is replaced once the new lines are on disk
+    offsets_path = meta_path.with_suffix(".offsets.npy")
+    offsets = np.load(offsets_path)
+    pos = int(offsets[-1])
+    new_offsets = []
+    with open(meta_path, "ab") as f:
+        for item in items:
+            line = orjson.dumps(item) + b"\n"
+            f.write(line)
+            pos += len(line)
+            new_offsets.append(pos)
+    save_npy_atomic(offsets_path, np.concatenate([offsets, np.asarray(new_offsets, dtype=np.int64)]))
+
+
+def append_meta_arrays(items: List[dict], meta_path: Path) -> None:
+    # Keep the column arrays used for filtering in ask.py aligned with the JSONL rows
+    arrays_path = meta_path.with_suffix(".npz")
+    with np.load(arrays_path) as existing:
+        arrays = {k: existing[k] for k in existing.files}
+    new = meta_arrays(items)
+    savez_atomic(arrays_path, {k: np.concatenate([arrays[k], new[k]]) for k in new})
+
+
+def append_meta_db(items: List[dict], meta_path: Path, first_row: int) -> None:
+    # Register the new chunks under their filings in the metadata DB that build_faiss.py creates
+    db_path = meta_path.with_suffix(".sqlite")
+    if not db_path.exists():
+        # Index predates the DB; ask.py falls back to FAISS search until the next full build
+        return
+    con = sqlite3.connect(db_path)
+    try:
+        insert_meta_rows(con, items, first_row)
+        con.commit()
+    finally:
+        con.close()
+
+
+def add_chunks(
+    chunks: Iterable[dict],
+    index_path: Path,
+    meta_path: Path,
+    embed_model: str = "text-embedding-3-small",
+) -> int:
+    """Embed and append any chunks not already in the index; returns how many were added."""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY missing in .env")
-    client = OpenAI(api_key=api_key)
-
-    chunks_path = Path(args.chunks)
-    index_path = Path(args.index)
-    meta_path = Path(args.meta)
-
-    chunks = load_jsonl(chunks_path)
+    client = AsyncOpenAI(api_key=api_key)
 
     # If no index exists yet, fallback to full build
     if not index_path.exists() or not meta_path.exists():
         raise RuntimeError("Index/meta not found. Run embeddings/build_faiss.py first.")
 
     index = faiss.read_index(str(index_path))
-    meta = json.load(open(meta_path, "r", encoding="utf-8"))
 
-    existing_ids: Set[str] = set(x.get("chunk_id") for x in meta)
+    existing_ids = load_meta_ids(meta_path)
     new_items = [c for c in chunks if c.get("chunk_id") not in existing_ids]
 
     if not new_items:
         print("No new chunks to add. Index is up to date.")
-        return
+        return 0
 
     texts = [x["text"] for x in new_items]
-    vecs = embed_texts(client, texts, model=args.embed_model)
+    vecs = asyncio.run(embed_texts(client, texts, model=embed_model))
+    faiss.normalize_L2(vecs)
 
+    first_row = index.ntotal
     index.add(vecs)
-    meta.extend(new_items)
 
-    faiss.write_index(index, str(index_path))
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False)
+    # Metadata first, index last: a reader that picks up the new index must never
+    # find FAISS rows past the end of the metadata
+    append_meta(new_items, meta_path)
+    append_meta_arrays(new_items, meta_path)
+    append_meta_db(new_items, meta_path, first_row)
+    write_index_atomic(index, index_path)
 
     print(f"Added {len(new_items)} new chunks. Index now has {index.ntotal} vectors.")
+    return len(new_items)
+
+
+def main(argv: Optional[List[str]] = None):
+    load_dotenv()
+    p = argparse.ArgumentParser()
+    p.add_argument("--chunks", type=str, default="data/chunks/sec_chunks.jsonl")
+    p.add_argument("--index", type=str, default="data/index/sec.index")
+    p.add_argument("--meta", type=str, default="data/index/sec_meta.jsonl")
+    p.add_argument("--embed-model", type=str, default="text-embedding-3-small")
+    args = p.parse_args(argv)
+
+    add_chunks(load_jsonl(Path(args.chunks)), Path(args.index), Path(args.meta), embed_model=args.embed_model)
 
 
 if __name__ == "__main__":
@@ -1,21 +1,48 @@
 import argparse
+import base64
+import gzip
 import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
+import orjson
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from tqdm import tqdm
 
+_RE_BLANK_LINES = re.compile(r"\n{3,}")
+_RE_WS = re.compile(r"[ \t]{2,}")
 
-def html_to_text(html: str) -> str:
+
+def _extract_text_bs4(html: str) -> str:
     soup = BeautifulSoup(html, "lxml")
     for tag in soup(["script", "style", "noscript"]):
         tag.decompose()
-    text = soup.get_text(separator="\n")
-    text = re.sub(r"\r", "\n", text)
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    text = re.sub(r"[ \t]{2,}", " ", text)
+    return soup.get_text(separator="\n")
+
+
+def _extract_text(html: str) -> str:
+    try:
+        tree = LexborHTMLParser(html)
+        for node in tree.css("script,style,noscript"):
+            node.decompose()
+        root = tree.body or tree.root
+        if root is None:
+            raise ValueError("empty document")
+        return root.text(separator="\n")
+    except Exception:
+        # selectolax is much faster but stricter; fall back to the lxml tree on odd markup
+        return _extract_text_bs4(html)
+
+
+def html_to_text(html: str) -> str:
+    text = _extract_text(html)
+    text = _RE_BLANK_LINES.sub("\n\n", text.replace("\r", "\n"))
+    text = _RE_WS.sub(" ", text)
     return text.strip()
 
 
@@ -23,6 +50,8 @@ def clean_one(raw_item: Dict) -> Optional[Dict]:
     raw_html = raw_item.get("raw_html")
     if not raw_html:
         return None
+    if raw_item.get("_encoding") == "gzip+b64":
+        raw_html = gzip.decompress(base64.b64decode(raw_html)).decode("utf-8", errors="replace")
 
     text = html_to_text(raw_html)
     if len(text) < 200:
@@ -43,11 +72,21 @@ def clean_one(raw_item: Dict) -> Optional[Dict]:
     }
 
 
-def main():
+def process_one(fp_str: str, out_dir: str) -> Optional[Tuple[str, Dict]]:
+    # Runs in a worker process: parse + clean one raw filing, leave writing to the parent
+    raw_item = orjson.loads(Path(fp_str).read_bytes())
+    cleaned = clean_one(raw_item)
+    if not cleaned:
+        return None
+    return str(Path(out_dir) / Path(fp_str).name), cleaned
+
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--in-dir", type=str, default="data/raw/sec")
     parser.add_argument("--out-dir", type=str, default="data/clean/sec")
-    args = parser.parse_args()
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parallel cleaning processes")
+    args = parser.parse_args(argv)
 
     in_dir = Path(args.in_dir)
     out_dir = Path(args.out_dir)
@@ -59,16 +98,16 @@ def main():
         return
 
     saved = 0
-    for fp in tqdm(files, desc="Cleaning"):
-        with open(fp, "r", encoding="utf-8") as f:
-            raw_item = json.load(f)
-        cleaned = clean_one(raw_item)
-        if not cleaned:
-            continue
-        out_fp = out_dir / fp.name
-        with open(out_fp, "w", encoding="utf-8") as f:
-            json.dump(cleaned, f, ensure_ascii=False, indent=2)
-        saved += 1
+    worker = partial(process_one, out_dir=str(out_dir))
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        results = ex.map(worker, [str(fp) for fp in files], chunksize=4)
+        for result in tqdm(results, total=len(files), desc="Cleaning"):
+            if not result:
+                continue
+            out_fp, cleaned = result
+            with open(out_fp, "w", encoding="utf-8") as f:
+                json.dump(cleaned, f, ensure_ascii=False)
+            saved += 1
 
     print(f"Cleaned {saved} docs to {out_dir}")
 
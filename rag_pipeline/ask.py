@@ -1,142 +1,325 @@
 import argparse
-import json
+import hashlib
 import os
+import sqlite3
 from collections import defaultdict
+from contextlib import closing
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
 
 import faiss
 import numpy as np
+import orjson
 from dotenv import load_dotenv
 from openai import OpenAI
 
+DEFAULT_INDEX = "data/index/sec.index"
+DEFAULT_META = "data/index/sec_meta.jsonl"
+DEFAULT_EMBED_MODEL = "text-embedding-3-small"
+DEFAULT_CHAT_MODEL = "gpt-4o-mini"
+
+
+def embed_queries(client: OpenAI, qs: List[str], model: str) -> np.ndarray:
+    # One embeddings request for all queries -> (len(qs), D), L2-normalized
+    resp = client.embeddings.create(model=model, input=qs)
+    vecs = np.array([d.embedding for d in resp.data], dtype="float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
 
 def embed_query(client: OpenAI, q: str, model: str) -> np.ndarray:
-    resp = client.embeddings.create(model=model, input=[q])
-    vec = np.array([resp.data[0].embedding], dtype="float32")
-    faiss.normalize_L2(vec)
-    return vec
+    return embed_queries(client, [q], model)
+
+
+def embed_cache_key(question: str, model: str) -> str:
+    return hashlib.sha256(f"{model}:{question}".encode("utf-8")).hexdigest()
 
 
+@lru_cache(maxsize=4096)
 def parse_date(s: Optional[str]) -> Optional[datetime]:
+    # Filing dates repeat across every chunk of a doc, so memoize
     if not s:
         return None
     try:
-        return datetime.strptime(s, "%Y-%m-%d")
-    except Exception:
+        return datetime.fromisoformat(s)
+    except (TypeError, ValueError):
         return None
 
 
-def main():
-    load_dotenv()
-    parser = argparse.ArgumentParser()
-    parser.add_argument("question", type=str)
-    parser.add_argument("--index", type=str, default="data/index/sec.index")
-    parser.add_argument("--meta", type=str, default="data/index/sec_meta.json")
-    parser.add_argument("--embed-model", type=str, default="text-embedding-3-small")
-    parser.add_argument("--chat-model", type=str, default="gpt-4o-mini")
-    parser.add_argument("--k", type=int, default=25, help="retrieve more then filter")
-    parser.add_argument("--ticker", type=str, default=None, help="e.g., AMZN")
-    parser.add_argument("--doc-type", type=str, default=None, help="e.g., 8-K")
-    parser.add_argument("--most-recent", action="store_true", help="pick most recent doc after filtering")
-    parser.add_argument("--max-chunks", type=int, default=8, help="chunks to include in context")
-    args = parser.parse_args()
+def load_meta_rows(meta_path: Path, rows: Iterable[int]) -> Dict[int, dict]:
+    """Read only the given rows of the metadata JSONL via its byte-offset sidecar."""
+    offsets = np.load(meta_path.with_suffix(".offsets.npy"), mmap_mode="r")
+    out = {}
+    fd = os.open(meta_path, os.O_RDONLY)
+    try:
+        for row in set(rows):
+            start, end = int(offsets[row]), int(offsets[row + 1])
+            out[row] = orjson.loads(os.pread(fd, end - start, start))
+    finally:
+        os.close(fd)
+    return out
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY missing in .env")
 
-    client = OpenAI(api_key=api_key)
+@lru_cache(maxsize=4)
+def _load_meta_arrays(path: str, mtime_ns: int) -> Dict[str, np.ndarray]:
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
 
-    index = faiss.read_index(args.index)
-    meta = json.load(open(args.meta, "r", encoding="utf-8"))
 
-    qvec = embed_query(client, args.question, args.embed_model)
-    scores, idxs = index.search(qvec, args.k)
+def load_meta_arrays(meta_path: Path) -> Dict[str, np.ndarray]:
+    """Column arrays (ticker, doc_type, filing_date, url) aligned with metadata rows."""
+    arrays_path = Path(meta_path).with_suffix(".npz")
+    return _load_meta_arrays(str(arrays_path), arrays_path.stat().st_mtime_ns)
 
-    # Collect hits
-    hits = []
-    for score, idx in zip(scores[0].tolist(), idxs[0].tolist()):
-        if idx < 0:
-            continue
-        item = meta[idx]
-        m = item.get("meta", {})
-        hits.append((score, item, m))
 
-    # Optional metadata filter
-    if args.ticker:
-        t = args.ticker.strip().upper()
-        hits = [h for h in hits if (h[2].get("ticker") or "").upper() == t]
+def load_index(path: str, nprobe: Optional[int] = None) -> faiss.Index:
+    # IVF inverted lists are paged in on demand instead of read up front; other index types load normally
+    index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if nprobe:
+            ivf.nprobe = nprobe
+        # id -> (list, offset) map so score_rows can reconstruct by id. Built here, once,
+        # because the index may be shared by threads and the map is mutable state
+        ivf.make_direct_map()
+    return index
+
+
+def search(index: faiss.Index, qvecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    params = None
+    if getattr(faiss.downcast_index(index), "hnsw", None) is not None:
+        # efSearch must be >= k for HNSW to return k candidates reliably; passed per call so
+        # a shared index can be searched from several threads
+        params = faiss.SearchParametersHNSW(efSearch=max(64, k))
+    return index.search(qvecs, k, params=params)
+
+
+def latest_filing_rows(
+    meta_path: Path, ticker: str, doc_type: Optional[str] = None, n_rows: Optional[int] = None
+) -> Optional[np.ndarray]:
+    """FAISS rows of every chunk in the newest filing for ticker (and doc_type).
+
+    n_rows (the index's ntotal) limits this to rows the caller's index actually has,
+    since writers update the DB before swapping in the bigger index.
+    Returns None when there is no metadata DB next to meta_path (built by build_faiss.py).
+    """
+    db_path = Path(meta_path).with_suffix(".sqlite")
+    if not db_path.exists():
+        return None
+    limit = (1 << 62) if n_rows is None else n_rows
+    where, params = "f.ticker = ?", [ticker.strip().upper()]
+    if doc_type:
+        where += " AND f.doc_type = ?"
+        params.append(doc_type.strip().upper())
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as con:
+        rows = con.execute(
+            "SELECT row FROM chunks WHERE row < ? AND filing_id = "
+            f"(SELECT f.id FROM filings f WHERE {where} "
+            "AND EXISTS (SELECT 1 FROM chunks c WHERE c.filing_id = f.id AND c.row < ?) "
+            "ORDER BY f.filing_date DESC LIMIT 1)",
+            [limit, *params, limit],
+        ).fetchall()
+    return np.array([r[0] for r in rows], dtype=np.int64)
+
+
+def score_rows(index: faiss.Index, qvec: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Inner-product scores of one query against the stored vectors at rows, without a search.
+
+    Read-only on the index; IVF indexes must come from load_index (which builds their direct map).
+    """
+    return index.reconstruct_batch(rows) @ qvec.reshape(-1)
+
+
+def answer(
+    question: str,
+    *,
+    index: faiss.Index,
+    meta_path: Path,
+    client: OpenAI,
+    ticker: Optional[str] = None,
+    doc_type: Optional[str] = None,
+    most_recent: bool = False,
+    k: int = 25,
+    max_chunks: int = 8,
+    chat_model: str = DEFAULT_CHAT_MODEL,
+    embed_model: str = DEFAULT_EMBED_MODEL,
+    embed_cache: Optional[Dict[str, np.ndarray]] = None,
+) -> Tuple[str, List[str]]:
+    """Retrieve context for `question` and return (answer, source URLs).
+
+    If `embed_cache` is given, the question embedding is looked up / stored there
+    under embed_cache_key(), skipping the embeddings call for repeat questions.
+    """
+    if embed_cache is None:
+        qvec = embed_query(client, question, embed_model)
+    else:
+        key = embed_cache_key(question, embed_model)
+        if key not in embed_cache:
+            embed_cache[key] = embed_query(client, question, embed_model)[0]
+        qvec = embed_cache[key][None, :]
 
-    if args.doc_type:
-        dt = args.doc_type.strip().upper()
-        hits = [h for h in hits if (h[2].get("doc_type") or "").upper() == dt]
+    # Most recent filing of one ticker: look it up directly and score only its chunks
+    rows = latest_filing_rows(meta_path, ticker, doc_type, index.ntotal) if most_recent and ticker else None
+    if rows is not None:
+        scores, idxs = score_rows(index, qvec, rows), rows
+    else:
+        scores, idxs = search(index, qvec, k)
+        scores, idxs = scores[0], idxs[0]
+
+    return answer_from_search(
+        question, scores, idxs,
+        meta_path=meta_path, client=client, ticker=ticker, doc_type=doc_type,
+        most_recent=most_recent, max_chunks=max_chunks, chat_model=chat_model,
+    )
+
+
+def answer_from_search(
+    question: str,
+    scores: np.ndarray,
+    idxs: np.ndarray,
+    *,
+    meta_path: Path,
+    client: OpenAI,
+    ticker: Optional[str] = None,
+    doc_type: Optional[str] = None,
+    most_recent: bool = False,
+    max_chunks: int = 8,
+    chat_model: str = DEFAULT_CHAT_MODEL,
+) -> Tuple[str, List[str]]:
+    """Answer from one row of FAISS results, so callers can batch embedding + search."""
+    valid = idxs >= 0
+    rows, row_scores = idxs[valid], scores[valid]
+
+    # Optional metadata filter, vectorized over the column arrays
+    if ticker or doc_type:
+        arrays = load_meta_arrays(meta_path)
+        mask = np.ones(len(rows), dtype=bool)
+        if ticker:
+            mask &= arrays["ticker"][rows] == ticker.strip().upper()
+        if doc_type:
+            mask &= arrays["doc_type"][rows] == doc_type.strip().upper()
+        rows, row_scores = rows[mask], row_scores[mask]
+
+    # Collect hits, reading only the metadata rows that survived filtering
+    meta = load_meta_rows(Path(meta_path), rows.tolist())
+    hits = []
+    for score, idx in zip(row_scores.tolist(), rows.tolist()):
+        item = meta[idx]
+        hits.append((score, item, item.get("meta", {})))
 
     if not hits:
-        print("\n=== Answer ===\n")
-        print("No matching documents found after filtering.")
-        return
+        return "No matching documents found after filtering.", []
 
-    # If most-recent, pick the doc (by URL) with latest filing_date
-    if args.most_recent:
+    # If most-recent, pick the doc (by URL) with latest filing_date, in a single pass
+    if most_recent:
         by_url = defaultdict(list)
-        for score, item, m in hits:
-            by_url[m.get("url")].append((score, item, m))
-
         best_url = None
         best_date = None
-        for url, items in by_url.items():
-            # use max filing date among chunks for that url
-            dates = [parse_date(x[2].get("filing_date")) for x in items]
-            dates = [d for d in dates if d]
-            dmax = max(dates) if dates else None
-            if dmax and (best_date is None or dmax > best_date):
-                best_date = dmax
+        for h in hits:
+            url = h[2].get("url")
+            by_url[url].append(h)
+            d = parse_date(h[2].get("filing_date"))
+            if d and (best_date is None or d > best_date):
+                best_date = d
                 best_url = url
 
         if best_url:
             hits = by_url[best_url]
 
     # Sort hits by similarity score and take top chunks
-    hits = sorted(hits, key=lambda x: x[0], reverse=True)[: args.max_chunks]
+    hits = sorted(hits, key=lambda x: x[0], reverse=True)[:max_chunks]
 
-    context_blocks = []
     sources = []
+    seen = set()
     for score, item, m in hits:
-        context_blocks.append(
-            f"[{m.get('ticker')} | {m.get('doc_type')} | {m.get('filing_date')}] {item.get('text','')}"
-        )
-        if m.get("url"):
-            sources.append(m["url"])
+        # Up to 5 distinct URLs in score order; chunks of one filing share a URL
+        url = m.get("url")
+        if url and url not in seen and len(sources) < 5:
+            seen.add(url)
+            sources.append(url)
 
-    context = "\n\n---\n\n".join(context_blocks)
+    # Lay the context out in chunk_id order and ahead of the question, so the same
+    # set of chunks always yields the same prompt prefix and the provider's prompt
+    # cache can reuse it across follow-up questions on one filing.
+    hits.sort(key=lambda h: h[1].get("chunk_id") or "")
+    chunk_ids = [h[1].get("chunk_id") or "" for h in hits]
+    cache_key = hashlib.sha256(",".join(chunk_ids).encode("utf-8")).hexdigest()
+
+    context = "\n\n---\n\n".join(
+        f"[{m.get('ticker')} | {m.get('doc_type')} | {m.get('filing_date')}] {item.get('text','')}"
+        for _, item, m in hits
+    )
 
     prompt = f"""You are a financial market analyst assistant.
 Answer the user's question using ONLY the provided context.
 If the answer is not in the context, say what is missing (e.g., "the filing text doesn't include the disclosure section").
 
-Question: {args.question}
-
 Context:
 {context}
+
+Question: {question}
 """
 
     resp = client.chat.completions.create(
-        model=args.chat_model,
+        model=chat_model,
         messages=[
             {"role": "system", "content": "Be concise. Use bullet points. Prefer concrete facts with dates."},
             {"role": "user", "content": prompt},
         ],
         temperature=0.2,
+        # via extra_body so older openai clients (no prompt_cache_key kwarg) still work
+        extra_body={"prompt_cache_key": cache_key},
+    )
+
+    return resp.choices[0].message.content, sources
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("question", type=str)
+    parser.add_argument("--index", type=str, default=DEFAULT_INDEX)
+    parser.add_argument("--meta", type=str, default=DEFAULT_META)
+    parser.add_argument("--embed-model", type=str, default=DEFAULT_EMBED_MODEL)
+    parser.add_argument("--chat-model", type=str, default=DEFAULT_CHAT_MODEL)
+    parser.add_argument("--k", type=int, default=25, help="retrieve more then filter")
+    parser.add_argument("--ticker", type=str, default=None, help="e.g., AMZN")
+    parser.add_argument("--doc-type", type=str, default=None, help="e.g., 8-K")
+    parser.add_argument("--most-recent", action="store_true", help="pick most recent doc after filtering")
+    parser.add_argument("--max-chunks", type=int, default=8, help="chunks to include in context")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists to visit (default: value stored in index)")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY missing in .env")
+
+    client = OpenAI(api_key=api_key)
+    index = load_index(args.index, nprobe=args.nprobe)
+
+    text, sources = answer(
+        args.question,
+        index=index,
+        meta_path=Path(args.meta),
+        client=client,
+        ticker=args.ticker,
+        doc_type=args.doc_type,
+        most_recent=args.most_recent,
+        k=args.k,
+        max_chunks=args.max_chunks,
+        chat_model=args.chat_model,
+        embed_model=args.embed_model,
     )
 
     print("\n=== Answer ===\n")
-    print(resp.choices[0].message.content)
+    print(text)
 
-    print("\n=== Sources (top hits) ===")
-    for s in list(dict.fromkeys([u for u in sources if u]))[:5]:
-        print("-", s)
+    if sources:
+        print("\n=== Sources (top hits) ===")
+        for s in sources:
+            print("-", s)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,22 @@
 import argparse
+import asyncio
+import base64
+import gzip
 import json
 import os
 import re
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional
 
+import aiohttp
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 SEC_SUBMISSIONS_URL = "https://data.sec.gov/submissions/CIK{cik}.json"
 SEC_ARCHIVES_BASE = "https://www.sec.gov/Archives/edgar/data/{cik_nolead}/{accession_nodash}/{primary_doc}"
@@ -17,18 +24,95 @@ TICKER_TO_CIK_URL = "https://www.sec.gov/files/company_tickers.json"
 
 DEFAULT_USER_AGENT = "FinancialAnalystMVP/0.1 (contact: you@example.com)"  # change later
 
+TICKER_MAP_CACHE = Path("data/cache/ticker_map.json")
+TICKER_MAP_TTL_S = 24 * 60 * 60
+
+# SEC fair-access policy caps clients at 10 requests/second
+MAX_CONCURRENCY = 10
+
+# Transient SEC responses retried by both the sync session and the async fetcher
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+MAX_RETRY_WAIT_S = 60.0
+
 
 def normalize_tickers(tickers: List[str]) -> List[str]:
     return [t.strip().upper() for t in tickers if t.strip()]
 
 
+# Reuse connections (keep-alive, one TLS handshake per host) and retry transient SEC errors
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=MAX_CONCURRENCY,
+        pool_maxsize=MAX_CONCURRENCY,
+        max_retries=Retry(total=MAX_RETRIES, backoff_factor=0.5, status_forcelist=list(RETRY_STATUSES)),
+    ),
+)
+
+
 def sec_get(url: str, headers: Dict[str, str], timeout: int = 30) -> requests.Response:
-    r = requests.get(url, headers=headers, timeout=timeout)
+    r = _SESSION.get(url, headers=headers, timeout=timeout)
     r.raise_for_status()
     return r
 
 
-def load_ticker_map(headers: Dict[str, str]) -> Dict[str, str]:
+def _retry_after_s(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+async def _get(
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    url: str,
+    sleep_s: float,
+    timeout: int = 30,
+) -> str:
+    loop = asyncio.get_running_loop()
+    for attempt in range(MAX_RETRIES + 1):
+        async with sem:
+            started = loop.time()
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    if r.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                        r.raise_for_status()
+                        return await r.text()
+                    # Throttled or transient server error: honor Retry-After, else back off exponentially
+                    wait = _retry_after_s(r.headers.get("Retry-After"))
+                    if wait is None:
+                        wait = 0.5 * 2**attempt
+                    status = r.status
+            finally:
+                # Hold the slot for at least 1s so MAX_CONCURRENCY slots stay under SEC's req/s cap
+                await asyncio.sleep(max(sleep_s, 1.0 - (loop.time() - started)))
+        print(f"[WARN] HTTP {status} for {url}; retrying in {wait:.1f}s")
+        # Back off outside the semaphore so other requests keep their slots
+        await asyncio.sleep(min(wait, MAX_RETRY_WAIT_S))
+
+
+def load_ticker_map(
+    headers: Dict[str, str],
+    cache_path: Path = TICKER_MAP_CACHE,
+    ttl_s: float = TICKER_MAP_TTL_S,
+) -> Dict[str, str]:
+    # The ticker list barely changes; reuse a local copy for a day
+    if cache_path.exists() and time.time() - cache_path.stat().st_mtime < ttl_s:
+        try:
+            return json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            pass  # unreadable or truncated cache: re-fetch below
+
     r = sec_get(TICKER_TO_CIK_URL, headers=headers)
     data = r.json()
     mapping = {}
@@ -37,6 +121,12 @@ def load_ticker_map(headers: Dict[str, str]) -> Dict[str, str]:
         cik_int = row.get("cik_str")
         if ticker and cik_int is not None:
             mapping[ticker] = str(cik_int).zfill(10)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temp file and swap it in so an interrupted write never leaves a truncated cache
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(mapping), encoding="utf-8")
+    os.replace(tmp_path, cache_path)
     return mapping
 
 
@@ -55,78 +145,155 @@ def build_filing_doc_url(cik10: str, accession: str, primary_doc: str) -> str:
     )
 
 
-def scrape_sec_filings(
+def _write_json(fpath: Path, item: Dict) -> None:
+    # Filing HTML compresses ~10:1; preprocess/clean_docs.py decodes it again
+    item = dict(item)
+    item["raw_html"] = base64.b64encode(gzip.compress(item["raw_html"].encode("utf-8"))).decode("ascii")
+    item["_encoding"] = "gzip+b64"
+    with open(fpath, "w", encoding="utf-8") as f:
+        json.dump(item, f, ensure_ascii=False)
+
+
+async def _fetch_doc(
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    doc_url: str,
+    sleep_s: float,
+) -> Optional[str]:
+    try:
+        return await _get(session, sem, doc_url, sleep_s)
+    except Exception as e:
+        print(f"[WARN] Failed doc {doc_url}: {e}")
+        return None
+
+
+async def _fetch_ticker(
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    ticker: str,
+    cik10: str,
+    form_types: List[str],
+    limit_per_ticker: int,
+    sleep_s: float,
+) -> List[Dict]:
+    submissions = json.loads(await _get(session, sem, SEC_SUBMISSIONS_URL.format(cik=cik10), sleep_s))
+
+    recent = submissions.get("filings", {}).get("recent", {})
+    forms = recent.get("form", [])
+    accession_numbers = recent.get("accessionNumber", [])
+    filing_dates = recent.get("filingDate", [])
+    primary_docs = recent.get("primaryDocument", [])
+    report_dates = recent.get("reportDate", [])
+
+    idxs = [i for i, f in enumerate(forms) if f in form_types][:limit_per_ticker]
+
+    filings = []
+    for i in idxs:
+        primary_doc = primary_docs[i] if i < len(primary_docs) else None
+        if not primary_doc:
+            continue
+        filings.append((i, primary_doc, build_filing_doc_url(cik10, accession_numbers[i], primary_doc)))
+
+    # Fan out all document fetches for this ticker; the semaphore bounds total in-flight requests
+    docs = await asyncio.gather(*[_fetch_doc(session, sem, url, sleep_s) for _, _, url in filings])
+
+    items = []
+    for (i, primary_doc, doc_url), raw_html in zip(filings, docs):
+        if raw_html is None:
+            continue
+
+        accession = accession_numbers[i]
+        items.append({
+            "id": f"{ticker}_{accession}_{primary_doc}",
+            "ticker": ticker,
+            "source": "SEC_EDGAR",
+            "doc_type": forms[i],
+            "cik": cik10,
+            "accession": accession,
+            "filing_date": filing_dates[i] if i < len(filing_dates) else None,
+            "report_date": report_dates[i] if i < len(report_dates) else None,
+            "url": doc_url,
+            "fetched_at": datetime.utcnow().isoformat() + "Z",
+            "raw_html": raw_html,
+        })
+
+    return items
+
+
+async def _iter_filings(
     tickers: List[str],
-    out_dir: Path,
     form_types: List[str],
     limit_per_ticker: int,
     user_agent: str,
     sleep_s: float,
-) -> int:
-    out_dir.mkdir(parents=True, exist_ok=True)
-
+) -> AsyncIterator[List[Dict]]:
+    """Yield each ticker's fetched filings as soon as that ticker completes."""
     headers = {"User-Agent": user_agent, "Accept-Encoding": "gzip, deflate"}
     ticker_map = load_ticker_map(headers)
 
-    total_saved = 0
-    for ticker in tqdm(tickers, desc="Tickers"):
-        cik10 = ticker_map.get(ticker)
-        if not cik10:
-            print(f"[WARN] No CIK found for {ticker}. Skipping.")
-            continue
-
-        time.sleep(sleep_s)
-        submissions = sec_get(SEC_SUBMISSIONS_URL.format(cik=cik10), headers=headers).json()
-
-        recent = submissions.get("filings", {}).get("recent", {})
-        forms = recent.get("form", [])
-        accession_numbers = recent.get("accessionNumber", [])
-        filing_dates = recent.get("filingDate", [])
-        primary_docs = recent.get("primaryDocument", [])
-        report_dates = recent.get("reportDate", [])
-
-        idxs = [i for i, f in enumerate(forms) if f in form_types][:limit_per_ticker]
-
-        for i in idxs:
-            form = forms[i]
-            accession = accession_numbers[i]
-            filing_date = filing_dates[i] if i < len(filing_dates) else None
-            report_date = report_dates[i] if i < len(report_dates) else None
-            primary_doc = primary_docs[i] if i < len(primary_docs) else None
-            if not primary_doc:
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        tasks = []
+        for ticker in tickers:
+            cik10 = ticker_map.get(ticker)
+            if not cik10:
+                print(f"[WARN] No CIK found for {ticker}. Skipping.")
                 continue
+            tasks.append(_fetch_ticker(session, sem, ticker, cik10, form_types, limit_per_ticker, sleep_s))
 
-            doc_url = build_filing_doc_url(cik10, accession, primary_doc)
+        for fut in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Tickers"):
+            yield await fut
 
-            time.sleep(sleep_s)
-            try:
-                raw_html = sec_get(doc_url, headers=headers, timeout=30).text
-            except Exception as e:
-                print(f"[WARN] Failed doc {doc_url}: {e}")
-                continue
 
-            item = {
-                "id": f"{ticker}_{accession}_{primary_doc}",
-                "ticker": ticker,
-                "source": "SEC_EDGAR",
-                "doc_type": form,
-                "cik": cik10,
-                "accession": accession,
-                "filing_date": filing_date,
-                "report_date": report_date,
-                "url": doc_url,
-                "fetched_at": datetime.utcnow().isoformat() + "Z",
-                "raw_html": raw_html,
-            }
+def fetch_sec_filings(
+    tickers: List[str],
+    form_types: List[str],
+    limit_per_ticker: int,
+    user_agent: str,
+    sleep_s: float,
+) -> List[Dict]:
+    """Fetch filings into memory without writing them to disk."""
+    async def collect() -> List[Dict]:
+        return [
+            item
+            async for items in _iter_filings(tickers, form_types, limit_per_ticker, user_agent, sleep_s)
+            for item in items
+        ]
+
+    return asyncio.run(collect())
 
+
+async def _scrape_async(
+    tickers: List[str],
+    out_dir: Path,
+    form_types: List[str],
+    limit_per_ticker: int,
+    user_agent: str,
+    sleep_s: float,
+) -> int:
+    total_saved = 0
+    async for items in _iter_filings(tickers, form_types, limit_per_ticker, user_agent, sleep_s):
+        for item in items:
             fpath = out_dir / (safe_filename(item["id"]) + ".json")
-            with open(fpath, "w", encoding="utf-8") as f:
-                json.dump(item, f, ensure_ascii=False, indent=2)
+            # Dumping multi-MB HTML is blocking work; keep it off the event loop
+            await asyncio.to_thread(_write_json, fpath, item)
             total_saved += 1
-
     return total_saved
 
 
+def scrape_sec_filings(
+    tickers: List[str],
+    out_dir: Path,
+    form_types: List[str],
+    limit_per_ticker: int,
+    user_agent: str,
+    sleep_s: float,
+) -> int:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return asyncio.run(_scrape_async(tickers, out_dir, form_types, limit_per_ticker, user_agent, sleep_s))
+
+
 def main():
     load_dotenv()
     parser = argparse.ArgumentParser()
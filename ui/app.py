@@ -1,15 +1,40 @@
+import atexit
 import os
+import queue
 import re
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
 
 import streamlit as st
-from dotenv import load_dotenv
 
 # --- Basic setup ---
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
-load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
+
+
+@st.cache_resource(show_spinner=False)
+def _env():
+    """Load .env once per server process rather than on every rerun."""
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
+    return True
+
+
+_env()
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+SEM_CACHE_PATH = PROJECT_ROOT / ".sem_cache.npz"
+SEM_CACHE_THRESHOLD = 0.95  # cosine similarity for treating two questions as the same
+EMB_CACHE_PATH = PROJECT_ROOT / ".emb_cache.npz"
+EMB_CACHE_MAX = 5000  # newest question embeddings kept in memory and on disk
+REPORTS_DIR = PROJECT_ROOT / "reports"
+
+_URL_RE = re.compile(r"-\s*(https?://\S+)")
 
 st.set_page_config(page_title="Financial Analyst MVP", layout="wide")
 
@@ -17,39 +42,341 @@ st.title("📈 Financial Analyst MVP — SEC Filings RAG (FAISS) + CrewAI")
 st.caption("Localhost UI for asking questions over SEC filings using your existing RAG pipeline.")
 
 
-def run_cmd(args_list):
-    """Run a command in the project root, return stdout (or raise with stderr)."""
-    proc = subprocess.run(
-        args_list,
-        cwd=str(PROJECT_ROOT),
-        capture_output=True,
-        text=True,
-        env=os.environ.copy(),
+def run_cmd_stream(args_list, on_line=None):
+    """Run a command in the project root, calling on_line(line) as stdout arrives.
+
+    Returns the full stdout (or raises with stderr).
+    """
+    lines = []
+    # stderr goes to a temp file so a chatty child can't block on a full pipe we aren't reading
+    with tempfile.TemporaryFile(mode="w+") as err:
+        with subprocess.Popen(
+            args_list,
+            cwd=str(PROJECT_ROOT),
+            stdout=subprocess.PIPE,
+            stderr=err,
+            text=True,
+            bufsize=1,
+            env=None,  # inherit our environment as-is
+        ) as proc:
+            for line in proc.stdout:
+                lines.append(line)
+                if on_line:
+                    on_line(line)
+        out = "".join(lines)
+        if proc.returncode != 0:
+            err.seek(0)
+            raise RuntimeError(err.read().strip() or out.strip() or "Command failed")
+    return out
+
+
+def run_cmd_bg(args_list, on_exit=None):
+    """Start run_cmd_stream on a daemon thread so the script can keep polling the page.
+
+    Returns (thread, queue); the queue gets ("line", text) items as output arrives,
+    then a final ("done", stdout) or ("error", exc). on_exit() runs on the worker once
+    the command has finished either way, even if the rerun that started it was interrupted.
+    """
+    q = queue.Queue()
+
+    def worker():
+        try:
+            q.put(("done", run_cmd_stream(args_list, lambda line: q.put(("line", line)))))
+        except Exception as e:
+            q.put(("error", e))
+        finally:
+            if on_exit:
+                on_exit()
+
+    t = threading.Thread(target=worker, daemon=True)
+    t.start()
+    return t, q
+
+
+def wait_with_status(q, label, max_lines=200, poll_s=0.5):
+    """Show a run_cmd_bg job in an st.status box with an elapsed-time counter.
+
+    Wakes every poll_s to redraw, so the page keeps ticking while the child runs.
+    Returns the full stdout (or raises the job's error).
+    """
+    start = time.monotonic()
+    lines = []
+    with st.status(label, expanded=True) as status:
+        tail = st.empty()
+        while True:
+            try:
+                items = [q.get(timeout=poll_s)]
+                while True:
+                    items.append(q.get_nowait())
+            except queue.Empty:
+                pass
+
+            elapsed = time.monotonic() - start
+            for kind, payload in items:
+                if kind == "line":
+                    lines.append(payload)
+                elif kind == "done":
+                    status.update(label=f"{label} done in {elapsed:.0f}s", state="complete", expanded=False)
+                    return payload
+                else:
+                    status.update(label=f"{label} failed after {elapsed:.0f}s", state="error")
+                    raise payload
+
+            status.update(label=f"{label} {elapsed:.0f}s")
+            if lines:
+                tail.code("".join(lines[-max_lines:]))
+
+
+def parse_answer_and_sources(lines):
+    """Extract === Answer === and === Sources === blocks from ask.py output.
+
+    Takes the output as a string or any iterable of lines (e.g. straight off a
+    stream) and walks it once.
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines(keepends=True)
+
+    ans_buf = []
+    src_buf = []
+    section = None
+
+    for line in lines:
+        marker = line.strip()
+        if marker == "=== Answer ===":
+            section = "answer"
+        elif marker == "=== Sources (top hits) ===":
+            section = "sources"
+        elif section == "answer":
+            ans_buf.append(line if line.endswith("\n") else line + "\n")
+        elif section == "sources":
+            src_buf.append(line)
+
+    # source lines look like: "- https://..."
+    # One filing's URL can appear once per hit; keep first-seen order
+    sources = list(dict.fromkeys(_URL_RE.findall("\n".join(src_buf))))
+    return "".join(ans_buf).strip(), sources
+
+
+@st.cache_resource(show_spinner=False)
+def _deps():
+    """numpy, rag_pipeline.ask (and with it faiss) and the OpenAI class.
+
+    Imported on first use rather than at the top, so the first page paint
+    doesn't wait on them.
+    """
+    import numpy as np
+    from openai import OpenAI
+
+    from rag_pipeline import ask
+
+    return np, ask, OpenAI
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _faiss(mtime_ns, inode):
+    """FAISS index, loaded once per version of the file and shared across reruns and sessions.
+
+    Keyed on the file's mtime/inode so a rebuild (from the UI, CLI or cron) is picked
+    up on the next ask; writers replace the file rather than rewriting the mapped one.
+    """
+    _, ask, _ = _deps()
+    # nprobe only applies to IVF indexes (the build default); other types ignore it
+    return ask.load_index(PROJECT_ROOT / ask.DEFAULT_INDEX, nprobe=16)
+
+
+def index_version():
+    """(mtime_ns, inode) of the index file; changes whenever it is rebuilt or appended to."""
+    _, ask, _ = _deps()
+    info = (PROJECT_ROOT / ask.DEFAULT_INDEX).stat()
+    return info.st_mtime_ns, info.st_ino
+
+
+@st.cache_resource(show_spinner=False)
+def _oai():
+    """One OpenAI client (and its connection pool) for every rerun and session."""
+    _, _, OpenAI = _deps()
+    return OpenAI()
+
+
+def _read_emb_file():
+    np, _, _ = _deps()
+    if not EMB_CACHE_PATH.exists():
+        return {}
+    with np.load(EMB_CACHE_PATH) as z:
+        return {key: z[key] for key in z.files}
+
+
+@st.cache_resource(show_spinner=False)
+def _emb_cache():
+    """Question embeddings keyed by embed_cache_key(), shared across reruns and sessions.
+
+    Loaded from disk on first use. At exit this process's entries are merged into the
+    file's current contents (other processes may have added their own) and only the
+    newest EMB_CACHE_MAX are kept.
+    """
+    np, _, _ = _deps()
+    cache = _read_emb_file()
+
+    def save():
+        ours = dict(cache)  # snapshot; ask threads may still be inserting
+        if not ours:
+            return
+        merged = _read_emb_file()
+        merged.update(ours)
+        newest = dict(list(merged.items())[-EMB_CACHE_MAX:])
+        tmp = EMB_CACHE_PATH.with_name(f"{EMB_CACHE_PATH.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **newest)
+        os.replace(tmp, EMB_CACHE_PATH)
+
+    atexit.register(save)
+    return cache
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_ask(question, ticker, doc_type, most_recent, k, max_chunks, model, embed_model, index_key):
+    """Answer once per distinct set of query params and index version; reruns and repeat asks hit the cache."""
+    _, ask, _ = _deps()
+    kwargs = {"chat_model": model} if model else {}
+    if embed_model:
+        kwargs["embed_model"] = embed_model
+    answer, sources = ask.answer(
+        question,
+        index=_faiss(*index_key),
+        meta_path=PROJECT_ROOT / ask.DEFAULT_META,
+        client=_oai(),
+        ticker=None if ticker == "ALL" else ticker,
+        doc_type=doc_type or None,
+        most_recent=most_recent,
+        k=k,
+        max_chunks=max_chunks,
+        embed_cache=_emb_cache(),
+        **kwargs,
     )
-    if proc.returncode != 0:
-        raise RuntimeError(proc.stderr.strip() or proc.stdout.strip() or "Command failed")
-    return proc.stdout
+    return "", answer, sources
 
 
-def parse_answer_and_sources(output: str):
-    """Extract === Answer === and === Sources === blocks from ask.py output."""
-    answer = ""
-    sources = []
+def ask_subprocess(question, ticker, doc_type, most_recent, k, max_chunks, model, embed_model):
+    """Run ask.py in a fresh process, streaming its output; not cached."""
+    # -u: unbuffered child stdout, so lines arrive as they are printed
+    cmd = [sys.executable, "-u", "rag_pipeline/ask.py", question, "--k", str(k), "--max-chunks", str(max_chunks)]
+
+    if ticker != "ALL":
+        cmd += ["--ticker", ticker]
+
+    if doc_type:
+        cmd += ["--doc-type", doc_type]
 
-    m_ans = re.search(r"=== Answer ===\s*\n\n(.*?)(?:\n\n=== Sources|\Z)", output, re.S)
-    if m_ans:
-        answer = m_ans.group(1).strip()
+    if most_recent:
+        cmd += ["--most-recent"]
 
-    m_src = re.search(r"=== Sources \(top hits\) ===\s*\n(.*)\Z", output, re.S)
-    if m_src:
-        lines = [ln.strip() for ln in m_src.group(1).splitlines() if ln.strip()]
-        # lines look like: "- https://..."
-        for ln in lines:
-            ln = ln.lstrip("-").strip()
-            if ln.startswith("http"):
-                sources.append(ln)
+    # optional args if your script supports them (safe to include if you implemented these flags)
+    # If your ask.py doesn't accept them, remove these two blocks.
+    if model:
+        cmd += ["--chat-model", model]
+    if embed_model:
+        cmd += ["--embed-model", embed_model]
 
-    return answer, sources
+    _, q = run_cmd_bg(cmd)
+    out = wait_with_status(q, "Running ask.py…")
+    answer, sources = parse_answer_and_sources(out)
+    return out, answer, sources
+
+
+# --- Semantic cache: reuse answers for near-duplicate questions with the same params ---
+def _read_sem_file():
+    np, _, _ = _deps()
+    if not SEM_CACHE_PATH.exists():
+        return {"vecs": np.empty((0, 0), dtype=np.float32), "keys": [], "answers": [], "sources": []}
+    with np.load(SEM_CACHE_PATH) as z:
+        return {
+            "vecs": z["vecs"],
+            "keys": z["keys"].tolist(),
+            "answers": z["answers"].tolist(),
+            "sources": z["sources"].tolist(),
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def get_sem_cache():
+    """One semantic cache per server process, shared by all sessions; hold its "lock" to use it.
+
+    Loaded from disk on first use. Entries added here are merged into the file's
+    current contents once at exit, so concurrent processes don't drop each other's.
+    """
+    np, _, _ = _deps()
+    cache = _read_sem_file()
+    cache["lock"] = threading.Lock()
+    cache["saved"] = len(cache["keys"])  # entries before this index are already on disk
+
+    def save():
+        with cache["lock"]:
+            start = cache["saved"]
+            if len(cache["keys"]) == start:
+                return
+            disk = _read_sem_file()
+            vecs = cache["vecs"][start:]
+            if disk["keys"] and disk["vecs"].shape[1] == vecs.shape[1]:
+                vecs = np.vstack([disk["vecs"], vecs])
+            else:
+                disk = {"keys": [], "answers": [], "sources": []}
+            np.savez(
+                SEM_CACHE_PATH,
+                vecs=vecs,
+                **{f: np.array(disk[f] + cache[f][start:], dtype=str) for f in ("keys", "answers", "sources")},
+            )
+
+    atexit.register(save)
+    return cache
+
+
+def embed_question(question, embed_model):
+    # Same cache ask.answer reads, so the in-process ask reuses this embedding
+    np, ask, _ = _deps()
+    cache = _emb_cache()
+    key = ask.embed_cache_key(question, embed_model)
+    vec = cache.get(key)
+    if vec is None:
+        resp = _oai().embeddings.create(model=embed_model, input=[question])
+        vec = np.asarray(resp.data[0].embedding, dtype=np.float32)
+        vec /= np.linalg.norm(vec)
+        cache[key] = vec
+        # Insertion order is age: drop the oldest once over the cap
+        for old_key in list(cache)[: max(0, len(cache) - EMB_CACHE_MAX)]:
+            cache.pop(old_key, None)
+    return vec
+
+
+def sem_cache_lookup(cache, key, qvec):
+    """Return (answer, sources) of the closest cached question asked with the same params, if close enough."""
+    np, _, _ = _deps()
+    with cache["lock"]:
+        if not cache["keys"] or cache["vecs"].shape[1] != qvec.shape[0]:
+            return None
+        sims = cache["vecs"] @ qvec
+        sims[np.asarray(cache["keys"]) != key] = -1.0
+        best = int(sims.argmax())
+        if sims[best] < SEM_CACHE_THRESHOLD:
+            return None
+        return cache["answers"][best], [u for u in cache["sources"][best].split("\n") if u]
+
+
+def sem_cache_store(cache, key, qvec, answer, sources):
+    np, _, _ = _deps()
+    with cache["lock"]:
+        if not cache["keys"] or cache["vecs"].shape[1] != qvec.shape[0]:
+            # First entry, or the embedding model (and so the dimension) changed: start over
+            cache.update(vecs=np.empty((0, qvec.shape[0]), dtype=np.float32), keys=[], answers=[], sources=[], saved=0)
+        cache["vecs"] = np.vstack([cache["vecs"], qvec[None, :]])
+        cache["keys"].append(key)
+        cache["answers"].append(answer)
+        cache["sources"].append("\n".join(sources))
+
+
+@st.cache_data(show_spinner=False)
+def latest_report(mtime_ns):
+    """Newest daily report; keyed on the directory's mtime, so the scan reruns only when reports are added."""
+    return max(REPORTS_DIR.glob("daily_*.txt"), key=lambda p: p.stat().st_mtime, default=None)
 
 
 # --- Sidebar controls ---
@@ -68,6 +395,9 @@ max_chunks = st.sidebar.slider("Max chunks to summarize", min_value=3, max_value
 
 model = st.sidebar.text_input("Model (optional)", value="gpt-4o-mini")
 embed_model = st.sidebar.text_input("Embedding model (optional)", value="text-embedding-3-small")
+use_subprocess = st.sidebar.checkbox(
+    "Run ask.py as a subprocess", value=False, help="Slower; isolates each query in a fresh process."
+)
 
 st.sidebar.divider()
 st.sidebar.subheader("Automation")
@@ -80,19 +410,21 @@ col1, col2 = st.columns([2, 1], gap="large")
 
 with col1:
     st.subheader("Ask a question")
-    question = st.text_area(
-        "Query",
-        value="What did Amazon disclose in its most recent 8-K?",
-        height=90,
-    )
+    # A form only reruns the script on submit, so typing or double-clicks don't trigger extra RAG runs
+    with st.form("ask_form"):
+        question = st.text_area(
+            "Query",
+            value="What did Amazon disclose in its most recent 8-K?",
+            height=90,
+        )
 
-    ask = st.button("🔎 Ask", type="primary")
+        ask = st.form_submit_button("🔎 Ask", type="primary")
 
 with col2:
     st.subheader("What this UI does")
     st.markdown(
         """
-- Uses your existing `rag_pipeline/ask.py`
+- Uses your existing `rag_pipeline/ask.py` (in-process, index kept in memory)
 - Shows answer + source links
 - Runs locally on your machine
         """
@@ -107,30 +439,64 @@ def ensure_api_key():
         st.stop()
 
 
-if ask:
-    ensure_api_key()
-    cmd = [sys.executable, "rag_pipeline/ask.py", question, "--k", str(k), "--max-chunks", str(max_chunks)]
+def run_exclusive(args_list, label):
+    """Run a long index-updating job with live output, refusing to start a second one while one is running.
 
-    if ticker != "ALL":
-        cmd += ["--ticker", ticker]
+    Caches are invalidated from the worker when the job ends, not by this rerun,
+    which a widget change may interrupt long before then.
+    """
+    # Track the worker thread rather than a flag: if a widget change interrupts this
+    # rerun, the child keeps going in the background and must still block new jobs.
+    job = st.session_state.get("job")
+    if job is not None and job.is_alive():
+        st.warning("Another job is already running. Wait for it to finish.")
+        st.stop()
+    t, q = run_cmd_bg(args_list, on_exit=invalidate_caches)
+    st.session_state["job"] = t
+    return wait_with_status(q, label)
 
-    if doc_type:
-        cmd += ["--doc-type", doc_type]
 
-    if most_recent:
-        cmd += ["--most-recent"]
+def invalidate_caches():
+    # The index changed; cached answers may be stale. Runs on a job's worker thread,
+    # so no session_state here
+    cached_ask.clear()
+    _faiss.clear()
+    cache = get_sem_cache()
+    with cache["lock"]:
+        cache.update(keys=[], answers=[], sources=[], saved=0)
+        SEM_CACHE_PATH.unlink(missing_ok=True)
 
-    # optional args if your script supports them (safe to include if you implemented these flags)
-    # If your ask.py doesn't accept them, remove these two blocks.
-    if model:
-        cmd += ["--chat-model", model]
-    if embed_model:
-        cmd += ["--embed-model", embed_model]
 
+if ask:
+    ensure_api_key()
     with st.spinner("Running RAG query..."):
         try:
-            out = run_cmd(cmd)
-            answer, sources = parse_answer_and_sources(out)
+            _, ask_mod, _ = _deps()
+            # A blank sidebar field means ask.py's default; resolve it once so the question
+            # embedding, both cache keys and the ask itself all use the same model
+            embed_model = embed_model or ask_mod.DEFAULT_EMBED_MODEL
+            sem_cache = get_sem_cache()
+            index_key = index_version()
+            # Keyed on the index version too, so answers from before a rebuild never match
+            sem_key = "|".join(
+                map(str, [ticker, doc_type, most_recent, k, max_chunks, model, embed_model, *index_key])
+            )
+            qvec = embed_question(question, embed_model)
+            hit = sem_cache_lookup(sem_cache, sem_key, qvec)
+            if hit:
+                answer, sources = hit
+                out = "(served from semantic cache: a near-identical question was already answered)"
+            else:
+                if use_subprocess:
+                    out, answer, sources = ask_subprocess(
+                        question, ticker, doc_type, most_recent, k, max_chunks, model, embed_model
+                    )
+                else:
+                    out, answer, sources = cached_ask(
+                        question, ticker, doc_type, most_recent, k, max_chunks, model, embed_model, index_key
+                    )
+                if answer:
+                    sem_cache_store(sem_cache, sem_key, qvec, answer, sources)
         except Exception as e:
             st.error(f"Error: {e}")
             st.stop()
@@ -140,46 +506,46 @@ if ask:
 
     st.subheader("🔗 Sources")
     if sources:
-        for s in sources:
-            st.markdown(f"- {s}")
+        st.markdown("\n".join(f"- {s}" for s in sources))
     else:
         st.write("No sources parsed. (The answer may still be valid — check the raw output below.)")
 
-    with st.expander("Raw output (debug)"):
-        st.code(out)
+    if out:
+        with st.expander("Raw output (debug)"):
+            st.code(out)
 
 
 if run_daily:
     ensure_api_key()
-    with st.spinner("Generating daily report..."):
-        try:
-            out = run_cmd([sys.executable, "automation/daily_report.py"])
-        except Exception as e:
-            st.error(f"Error: {e}")
-            st.stop()
+    try:
+        out = run_exclusive([sys.executable, "-u", "automation/daily_report.py"], "Generating daily report…")
+    except Exception as e:
+        st.error(f"Error: {e}")
+        st.stop()
 
     st.success("Daily report generated.")
     st.code(out.strip() or "(ok)")
 
     # Show the newest report if it exists
-    reports_dir = PROJECT_ROOT / "reports"
-    if reports_dir.exists():
-        reports = sorted(reports_dir.glob("daily_*.txt"))
-        if reports:
-            latest = reports[-1]
+    if REPORTS_DIR.exists():
+        latest = latest_report(REPORTS_DIR.stat().st_mtime_ns)
+        if latest:
             st.subheader("Latest report")
             st.caption(str(latest))
-            st.text(latest.read_text(encoding="utf-8")[:4000])
+            with latest.open("r", encoding="utf-8") as f:
+                st.text(f.read(4000))
 
 
 if run_crew:
     ensure_api_key()
-    with st.spinner("Running CrewAI workflow (scrape → clean → index → report)..."):
-        try:
-            out = run_cmd([sys.executable, "-m", "automation.run_with_crewai"])
-        except Exception as e:
-            st.error(f"Error: {e}")
-            st.stop()
+    try:
+        out = run_exclusive(
+            [sys.executable, "-u", "-m", "automation.run_with_crewai"],
+            "Running CrewAI workflow (scrape → clean → index → report)…",
+        )
+    except Exception as e:
+        st.error(f"Error: {e}")
+        st.stop()
 
     st.success("CrewAI workflow finished.")
     st.code(out.strip() or "(ok)")